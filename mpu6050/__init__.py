@@ -1 +1,2 @@
-from .mpu6050 import mpu6050
+from .mpu6050 import mpu6050, AccelXYZ, GyroXYZ
+from ._kernels import format_line
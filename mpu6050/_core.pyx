@@ -0,0 +1,48 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""Compiled versions of the kernels in _kernels.py.
+
+Built by setup.py when Cython is available; _kernels falls back to its own
+implementations when this extension can't be imported.
+"""
+from libc.math cimport atan2, sqrt, M_PI
+from libc.stdio cimport snprintf
+
+cdef bytes LINE_FMT = b'{"x":%.6f,"y":%.6f,"z":%.6f,"theta":%.6f,"timestamp":%.6f}\n'
+
+
+cdef inline double angle(double x, double y, double z) noexcept nogil:
+    return atan2(sqrt(x * x + z * z), y) * (180.0 / M_PI)
+
+
+cdef inline int _word(const unsigned char* buf, int i) noexcept nogil:
+    cdef int value = (buf[i] << 8) | buf[i + 1]
+    return value - ((value & 0x8000) << 1)
+
+
+cdef void decode_block(const unsigned char* buf, double am, double gm, double* out7) noexcept nogil:
+    out7[0] = _word(buf, 0) * am
+    out7[1] = _word(buf, 2) * am
+    out7[2] = _word(buf, 4) * am
+    out7[3] = _word(buf, 6) / 340.0 + 36.53
+    out7[4] = _word(buf, 8) * gm
+    out7[5] = _word(buf, 10) * gm
+    out7[6] = _word(buf, 12) * gm
+
+
+def decode(const unsigned char[::1] buf, double am, double gm, double[::1] out):
+    """Decode a 14 byte ACCEL_XOUTH..GYRO_ZOUTL block, see _kernels.decode()."""
+    if buf.shape[0] < 14 or out.shape[0] < 7:
+        raise ValueError('decode() needs a 14 byte block and 7 outputs')
+    with nogil:
+        decode_block(&buf[0], am, gm, &out[0])
+    return angle(out[0], out[1], out[2])
+
+
+cpdef bytes format_line(double x, double y, double z, double theta, double timestamp):
+    """Format one JSON log record, see _kernels.format_line()."""
+    cdef char line[256]
+    cdef int n = snprintf(line, sizeof(line), <const char*>LINE_FMT, x, y, z, theta, timestamp)
+    if n < 0 or n >= <int>sizeof(line):
+        # Only reachable for absurdly large values
+        return LINE_FMT % (x, y, z, theta, timestamp)
+    return line[:n]
@@ -0,0 +1,71 @@
+"""Numeric kernels for decoding and logging MPU-6050 sample blocks.
+
+If the Cython extension _core has been built its kernels are used.
+Otherwise they are compiled with numba when it is installed and run as
+plain Python when it isn't, so neither is a required dependency.
+"""
+import math
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        """Stand-in for numba.njit that leaves the function uncompiled."""
+        def wrap(func):
+            return func
+        return wrap
+
+
+# No fastmath: results must match the Cython and Python builds bit for bit,
+# and fused multiply-adds would change the last bits on ARM.
+@njit(cache=True)
+def _word(buf, i):
+    """Combine buf[i] (high) and buf[i+1] (low) into a signed 16 bit value."""
+    value = (int(buf[i]) << 8) | int(buf[i + 1])
+    return value - ((value & 0x8000) << 1)
+
+
+@njit(cache=True)
+def decode(buf, am, gm, out):
+    """Decode a 14 byte ACCEL_XOUTH..GYRO_ZOUTL block.
+
+    buf -- the raw block (bytes, bytearray or a uint8 array).
+    am -- multiplier from accelerometer counts to m/s^2.
+    gm -- multiplier from gyroscope counts to deg/s.
+    out -- preallocated buffer of 7 floats, filled with
+    (ax, ay, az, temp, gx, gy, gz).
+    Returns the tilt angle in degrees, as mpu6050.calculate_angle().
+    """
+    ax = _word(buf, 0) * am
+    ay = _word(buf, 2) * am
+    az = _word(buf, 4) * am
+    out[0] = ax
+    out[1] = ay
+    out[2] = az
+    out[3] = _word(buf, 6) / 340.0 + 36.53
+    out[4] = _word(buf, 8) * gm
+    out[5] = _word(buf, 10) * gm
+    out[6] = _word(buf, 12) * gm
+    return math.degrees(math.atan2(math.sqrt(ax * ax + az * az), ay))
+
+
+LINE_FMT = b'{"x":%.6f,"y":%.6f,"z":%.6f,"theta":%.6f,"timestamp":%.6f}\n'
+
+
+def format_line(x, y, z, theta, timestamp):
+    """Format one JSON log record as bytes."""
+    return LINE_FMT % (x, y, z, theta, timestamp)
+
+
+# Keep the numba/Python versions reachable so they can be checked against _core
+fallback_decode, fallback_format_line = decode, format_line
+
+# Prefer the compiled extension when it has been built
+try:
+    from ._core import decode, format_line
+    HAVE_CORE = True
+except ImportError:
+    HAVE_CORE = False
@@ -7,13 +7,63 @@ Copyright (c) 2015, 2016, 2017 MrTijn/Tijndagamer
 Forked by Daniel Boe
 """
 import smbus2
+import asyncio
+import ctypes
+import errno
+import fcntl
+import struct
 import logging
-from math import acos,sqrt,pi
+import math
+import threading
+import time
+from array import array
+from collections import namedtuple
+
+from . import _kernels
+
+try:
+    from smbus2.smbus2 import I2C_RDWR, I2C_M_RD, i2c_rdwr_ioctl_data
+except ImportError:
+    I2C_RDWR = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import gpiod
+    from gpiod.line import Edge
+except ImportError:
+    gpiod = None
 
 l = logging.getLogger(__name__)
 l.setLevel(logging.root.level)
 
+# ioctl errnos meaning the adapter doesn't support I2C_RDWR, as opposed to
+# a failed transfer
+_RDWR_UNSUPPORTED = (errno.EOPNOTSUPP, errno.EINVAL)
+
+# Return types of get_accel_data() (m/s^2) and get_gyro_data() (deg/s)
+AccelXYZ = namedtuple('AccelXYZ', 'x y z')
+GyroXYZ = namedtuple('GyroXYZ', 'x y z')
+
+_atan2, _sqrt, _deg = math.atan2, math.sqrt, math.degrees
+
+def _angle(x, y, z):
+    """Angle in degrees between the acceleration vector and the y axis."""
+    # Same angle as acos(y/|xyz|), but atan2 is defined everywhere
+    return _deg(_atan2(_sqrt(x*x + z*z), y))
+
+def _temp(raw):
+    """Converts a raw TEMP_OUT count (or array of counts) to degrees Celcius."""
+    # Formula from the MPU-6050 Register Map and Descriptions revision 4.2, page 30
+    return None if raw is None else raw / 340.0 + 36.53
+
 class mpu6050:
+    __slots__ = ('address', 'bus', 'accel_range', 'gyro_range',
+                 'dlpf', 'sample_rate', '_requested_rate', '_int_line', '_fd', '_rdwr_arg', '_use_rdwr',
+                 '_accel_mul', '_gyro_mul', '_out', '_buf', '_mv', '_unpacker', '_lock')
 
     # Global Variables
     GRAVITIY_MS2 = 9.80665
@@ -89,9 +139,26 @@ class mpu6050:
     ACCEL_CONFIG = 0x1C
     GYRO_CONFIG = 0x1B
 
-    def __init__(self, address, bus=1):
-        
-        l.info(f'{__class__.__name__}.__init__(), address={address}')
+    # Sample rate and digital low pass filter registers
+    SMPLRT_DIV = 0x19
+    CONFIG = 0x1A
+
+    # Interrupt registers
+    INT_PIN_CFG = 0x37
+    INT_ENABLE = 0x38
+    INT_STATUS = 0x3A
+
+    def __init__(self, address, bus=1, int_pin=None, gpio_chip='/dev/gpiochip0'):
+        """Opens the I2C bus and wakes up the sensor.
+
+        address -- I2C address of the MPU-6050, usually 0x68.
+        bus -- number of the I2C bus.
+        int_pin -- GPIO line the MPU-6050 INT pin is wired to. If given,
+        wait_for_sample() blocks on the data ready interrupt (needs gpiod);
+        otherwise it sleeps for one sample period.
+        gpio_chip -- the GPIO chip int_pin belongs to.
+        """
+        l.info('%s.__init__(), address=%s', __class__.__name__, address)
         self.address = address
         self.bus = smbus2.SMBus(bus)
 
@@ -101,6 +168,130 @@ class mpu6050:
         self.set_accel_range('4g')
         self.set_gyro_range('500deg')
 
+        # Let the sensor filter and decimate instead of oversampling at 8 kHz
+        self._requested_rate = None
+        self.set_dlpf(3)
+        self.set_sample_rate(50)
+
+        self._int_line = None
+        if int_pin is not None:
+            self._setup_data_ready_interrupt(gpio_chip, int_pin)
+
+        # Reusable buffers for the 14 byte sample block and its decoded
+        # values, so the read path doesn't allocate per sample. The lock
+        # keeps concurrent reads (e.g. from executor threads) from tearing them
+        self._lock = threading.Lock()
+        self._buf = bytearray(14)
+        self._mv = memoryview(self._buf)
+        self._unpacker = struct.Struct('>hhhhhhh').unpack_from
+        self._out = array('d', [0.0] * 7)
+
+        # Compile the kernel now so the first real sample doesn't pay for it
+        if _kernels.HAVE_NUMBA and not _kernels.HAVE_CORE:
+            _kernels.decode(self._buf, 1.0, 1.0, self._out)
+
+        self._fd = self.bus.fd
+        self._use_rdwr = True
+        self._rdwr_arg = self._build_sample_ioctl()
+
+    def _setup_data_ready_interrupt(self, gpio_chip, int_pin):
+        """Enables the DATA_RDY interrupt and requests the GPIO line for it."""
+        l.info('%s._setup_data_ready_interrupt(), chip=%s, pin=%s', __class__.__name__, gpio_chip, int_pin)
+        if gpiod is None:
+            raise ImportError('int_pin requires gpiod')
+
+        self._int_line = gpiod.request_lines(
+            gpio_chip, consumer='mpu6050',
+            config={int_pin: gpiod.LineSettings(edge_detection=Edge.RISING)})
+
+        # Active high, latched until INT_STATUS is read; raise on data ready
+        self.bus.write_byte_data(self.address, self.INT_PIN_CFG, 0x20)
+        self.bus.write_byte_data(self.address, self.INT_ENABLE, 0x01)
+        self.bus.read_byte_data(self.address, self.INT_STATUS)
+
+    def wait_for_sample(self, timeout_ms):
+        """Blocks until the sensor has a new sample ready.
+
+        Without an INT pin this sleeps for one sample period.
+        timeout_ms -- the longest time to wait for the interrupt.
+        Returns True if a sample is ready, False on timeout.
+        """
+        if self._int_line is None:
+            time.sleep(1.0/self.sample_rate)
+            return True
+
+        if not self._int_line.wait_edge_events(timeout_ms/1000.0):
+            return False
+        self._int_line.read_edge_events()
+
+        # Reading INT_STATUS releases the latched INT pin for the next edge
+        self.bus.read_byte_data(self.address, self.INT_STATUS)
+        return True
+
+    def _build_sample_ioctl(self):
+        """Builds the I2C_RDWR argument for the 14 byte sample block.
+
+        The read message points straight at self._buf, so one ioctl on the
+        bus file descriptor refreshes the buffer in place.
+        Returns the i2c_rdwr_ioctl_data, or None if smbus2 doesn't provide it.
+        """
+        if I2C_RDWR is None:
+            return None
+        try:
+            write = smbus2.i2c_msg.write(self.address, [self.ACCEL_XOUTH])
+            read = smbus2.i2c_msg(
+                addr=self.address, flags=I2C_M_RD, len=len(self._buf),
+                buf=(ctypes.c_char * len(self._buf)).from_buffer(self._buf))
+            return i2c_rdwr_ioctl_data.create(write, read)
+        except (AttributeError, TypeError):
+            l.error('%s._build_sample_ioctl(), falling back to smbus2', __class__.__name__)
+            return None
+
+    def _read_sample_block(self):
+        """Reads the ACCEL_XOUTH..GYRO_ZOUTL block into self._buf.
+
+        Callers must hold self._lock. Raises OSError if the bus read fails.
+        """
+        # Read once: _disable_rdwr() may clear it from a read_i2c_word() call,
+        # which doesn't hold self._lock
+        arg = self._rdwr_arg
+        if arg is not None:
+            try:
+                fcntl.ioctl(self._fd, I2C_RDWR, arg)
+                return
+            except OSError as e:
+                if e.errno not in _RDWR_UNSUPPORTED:
+                    raise
+                self._disable_rdwr(e)
+        self._buf[:] = self._read_block(self.ACCEL_XOUTH, 14)
+
+    def _disable_rdwr(self, error):
+        """Switches to SMBus block reads after I2C_RDWR was rejected."""
+        l.warning('%s: I2C_RDWR not supported by the adapter (%s), using SMBus block reads',
+                  __class__.__name__, error)
+        self._rdwr_arg = None
+        self._use_rdwr = False
+
+    def _read_block(self, register, length):
+        """Read length consecutive registers starting at register.
+
+        The register write and the data read are issued as one combined
+        I2C_RDWR transaction. If the adapter doesn't support that, the SMBus
+        block read is used instead, for this and all later reads.
+        Returns the bytes read. Raises OSError if the bus read fails.
+        """
+        if self._use_rdwr:
+            write = smbus2.i2c_msg.write(self.address, [register])
+            read = smbus2.i2c_msg.read(self.address, length)
+            try:
+                self.bus.i2c_rdwr(write, read)
+                return bytes(read)
+            except OSError as e:
+                if e.errno not in _RDWR_UNSUPPORTED:
+                    raise
+                self._disable_rdwr(e)
+        return bytes(self.bus.read_i2c_block_data(self.address, register, length))
+
     def read_i2c_word(self, register):
         """Read two i2c registers and combine them.
 
@@ -109,38 +300,148 @@ class mpu6050:
         """
         # Read the data from the registers
         try:
-            high = self.bus.read_byte_data(self.address, register)
-        except OSError:
-            l.error(f'{__class__.__name__}.read_i2c_word(), register = {register}, IO Error, reading first 8 bits')
-            return None
-        try:
-            low = self.bus.read_byte_data(self.address, register + 1)
-        except OSError:
-            l.error(f'{__class__.__name__}.read_i2c_word(), register = {register}, IO Error, reading second 8 bits')
+            data = self._read_block(register, 2)
+        except OSError as e:
+            l.error('%s.read_i2c_word(), register = %s, IO Error: %s', __class__.__name__, register, e)
             return None
 
-        value = (high << 8) + low
+        return struct.unpack('>h', data)[0]
 
-        if (value >= 0x8000):
-            return -((65535 - value) + 1)
-        else:
-            return value
+    def read_sensor_block(self):
+        """Burst-read the accelerometer, temperature and gyroscope registers.
 
-    def get_temp(self):
-        """Reads the temperature from the onboard temperature sensor of the MPU-6050.
+        The MPU-6050 auto-increments its register pointer, so all 14 bytes
+        from ACCEL_XOUTH to GYRO_ZOUTL are fetched in one I2C transaction.
+        Returns a tuple of raw signed counts (ax, ay, az, temp, gx, gy, gz),
+        or a tuple of Nones if the bus read fails.
+        """
+        with self._lock:
+            try:
+                self._read_sample_block()
+            except OSError as e:
+                l.error('%s.read_sensor_block(), IO Error: %s', __class__.__name__, e)
+                return (None,) * 7
+
+            return self._unpacker(self._mv, 0)
+
+    def read_sample(self):
+        """Reads and decodes one accelerometer, temperature and gyro sample.
+
+        Uses a single burst read and the compiled decode kernel.
+        Returns a tuple (accel, gyro, temp, angle) where accel and gyro are
+        named tuples as returned by get_accel_data() and get_gyro_data().
+        On a bus error every value is None.
+        """
+        with self._lock:
+            try:
+                self._read_sample_block()
+            except OSError as e:
+                l.error('%s.read_sample(), IO Error: %s', __class__.__name__, e)
+                return AccelXYZ(None, None, None), GyroXYZ(None, None, None), None, None
+
+            out = self._out
+            angle = _kernels.decode(self._buf, self._accel_mul, self._gyro_mul, out)
+
+            return (AccelXYZ(out[0], out[1], out[2]),
+                    GyroXYZ(out[4], out[5], out[6]),
+                    out[3], angle)
+
+    async def async_sample(self, loop=None):
+        """Coroutine version of read_sample().
+
+        read_sample() runs in the loop's default executor so the event loop
+        stays free during the I2C transaction.
+        loop -- the event loop to use, defaults to the running loop.
+        Returns a tuple (accel, gyro, temp, angle) like read_sample().
+        """
+        l.info('%s.async_sample()', __class__.__name__)
+        loop = loop or asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.read_sample)
 
-        Returns the temperature in degrees Celcius.
+    async def stream(self, hz):
+        """Asynchronously yields samples from async_sample() at about hz Hz.
+
+        With an INT pin configured each sample waits for the data ready
+        interrupt instead, so the rate follows set_sample_rate(). If the
+        interrupt times out the stream falls back to timed polling.
+        Usage: async for accel, gyro, temp, angle in sensor.stream(10): ...
+        """
+        l.info('%s.stream(), hz=%s', __class__.__name__, hz)
+        loop = asyncio.get_running_loop()
+        period = 1.0 / hz
+        use_int = self._int_line is not None
+        while True:
+            # Allow two sample periods, so slow rates don't look like a dead line
+            timeout_ms = max(200, 2 * 1000 / self.sample_rate)
+            if use_int and not await loop.run_in_executor(None, self.wait_for_sample, timeout_ms):
+                l.warning('%s.stream(), no data ready interrupt within %d ms, falling back to %s Hz polling',
+                          __class__.__name__, timeout_ms, hz)
+                use_int = False
+            yield await self.async_sample(loop)
+            if not use_int:
+                await asyncio.sleep(period)
+
+    def read_raw_batch(self, n, dt):
+        """Reads n samples of raw sensor counts, dt seconds apart.
+
+        Requires numpy. Samples whose bus read failed are dropped.
+        Returns a tuple (raw, timestamps): raw is an (N, 7) int16 array of
+        (ax, ay, az, temp, gx, gy, gz) counts and timestamps an (N,) float64
+        array of time.time() values, with N <= n.
         """
+        l.info('%s.read_raw_batch(), n=%s, dt=%s', __class__.__name__, n, dt)
+        if np is None:
+            raise ImportError('read_raw_batch() requires numpy')
+
+        raw=np.empty((n,7), dtype=np.int16)
+        timestamps=np.empty(n, dtype=np.float64)
+        i=0
+        for k in range(n):
+            block=self.read_sensor_block()
+            if block[0] is not None:
+                raw[i]=block
+                timestamps[i]=time.time()
+                i+=1
+            if k < n - 1:
+                time.sleep(dt)
+
+        return raw[:i], timestamps[:i]
+
+    def decode_batch(self, raw):
+        """Converts an (N, 7) array from read_raw_batch() to physical units.
+
+        Requires numpy.
+        Returns a tuple (accel, gyro, temp, angle): accel is (N, 3) float32 in
+        m/s^2, gyro is (N, 3) float32 in deg/s, temp is (N,) in degrees
+        Celcius and angle is (N,) as computed by calculate_angle().
+        """
+        l.info('%s.decode_batch()', __class__.__name__)
+        if np is None:
+            raise ImportError('decode_batch() requires numpy')
+
+        accel=raw[:,0:3].astype(np.float32)*np.float32(self._accel_mul)
+        gyro=raw[:,4:7].astype(np.float32)*np.float32(self._gyro_mul)
+        temp=_temp(raw[:,3])
+
+        x,y,z=accel[:,0],accel[:,1],accel[:,2]
+        angle=np.degrees(np.arctan2(np.sqrt(x*x + z*z), y))
 
-        l.info(f'{__class__.__name__}.get_temp()')
+        return accel, gyro, temp, angle
 
-        raw_temp = self.read_i2c_word(self.TEMP_OUTH)
+    def get_temp(self, raw=None):
+        """Reads the temperature from the onboard temperature sensor of the MPU-6050.
+
+        raw -- optional raw temperature count, e.g. read_sensor_block()[3].
+        If omitted the register is read from the sensor.
+        Returns the temperature in degrees Celcius, or None if the read failed.
+        """
+
+        l.info('%s.get_temp()', __class__.__name__)
 
-        # Get the actual temperature using the formule given in the
-        # MPU-6050 Register Map and Descriptions revision 4.2, page 30
-        actual_temp = (raw_temp / 340.0) + 36.53
+        if raw is None:
+            raw = self.read_i2c_word(self.TEMP_OUTH)
 
-        return actual_temp
+        return _temp(raw)
 
     def set_accel_range(self, accel_range):
         """Sets the range of the accelerometer to range.
@@ -148,7 +449,7 @@ class mpu6050:
         pre-defined range is advised.
         """
 
-        l.info(f'{__class__.__name__}.set_accel_range() - Setting acceleration Range to {accel_range}')
+        l.info('%s.set_accel_range() - Setting acceleration Range to %s', __class__.__name__, accel_range)
         if mpu6050.ACCEL_RANGE_MAP.get(accel_range) is None:
             raise ValueError(f'{accel_range} is not a valid Acceleration Range')
 
@@ -158,38 +459,39 @@ class mpu6050:
         # Write the new range to the ACCEL_CONFIG register
         self.bus.write_byte_data(self.address, self.ACCEL_CONFIG, self.ACCEL_RANGE_MAP.get(accel_range))
         
-        # Store the current acceleration range
+        # Store the current acceleration range and the counts -> m/s^2 factor
         self.accel_range=accel_range
+        self._accel_mul=mpu6050.GRAVITIY_MS2/mpu6050.ACCEL_SCALE_MAP[accel_range]
 
-    def get_accel_data(self):
+    def get_accel_data(self, raw=None):
         """Gets and returns the X, Y and Z values from the accelerometer.
 
-        If g is True, it will return the data in g
-        If g is False, it will return the data in m/s^2
-        Returns a dictionary with the measurement results.
+        raw -- optional (x, y, z) raw counts, e.g. read_sensor_block()[0:3].
+        If omitted the registers are read from the sensor.
+        Returns an AccelXYZ named tuple with the measurement results in m/s^2.
         """
-        l.info(f'{__class__.__name__}.get_accel_data()')
+        l.info('%s.get_accel_data()', __class__.__name__)
 
-        xyz=[self.read_i2c_word(reg) for reg in [mpu6050.ACCEL_XOUTH,mpu6050.ACCEL_YOUTH,mpu6050.ACCEL_ZOUTH]]
+        if raw is None:
+            raw=self.read_sensor_block()[0:3]
+        xyz=raw
             
         try:
-            xyz=[i/mpu6050.ACCEL_SCALE_MAP.get(self.accel_range)*mpu6050.GRAVITIY_MS2 for i in xyz]
+            xyz=[v*self._accel_mul for v in xyz]
         except TypeError:
-            l.error(f'{__class__.__name__}.get_accel_data(), error')         
+            l.error('%s.get_accel_data(), error', __class__.__name__)
             xyz=[None,None,None]
 
-        return {'x': xyz[0], 'y': xyz[1], 'z': xyz[2]}
+        return AccelXYZ(xyz[0], xyz[1], xyz[2])
 
     def calculate_angle(self,xyz):
         """
            Calculates the angles between the acceleration vector components
+
+           xyz -- an AccelXYZ or any (x, y, z) sequence.
         """
-        l.info(f'{__class__.__name__}.calculate_angle()')
-        try:
-            angle=acos(xyz['y']/sqrt(xyz['x']**2 + xyz['y']**2 + xyz['z']**2))*180/pi
-        except (ValueError,TypeError):
-            angle=None
-        return angle 
+        l.info('%s.calculate_angle()', __class__.__name__)
+        return _angle(*xyz) if xyz[0] is not None else None
 
     def set_gyro_range(self, gyro_range):
         """Sets the range of the gyroscope to range.
@@ -197,7 +499,7 @@ class mpu6050:
         gyro_range -- the range to set the gyroscope to. Using a pre-defined
         range is advised.
         """
-        l.info(f'{__class__.__name__}.set_gyro_range() - Setting gyro Range to {gyro_range}')
+        l.info('%s.set_gyro_range() - Setting gyro Range to %s', __class__.__name__, gyro_range)
         if mpu6050.GYRO_RANGE_MAP.get(gyro_range) is None:
             raise ValueError(f'{gyro_range} is not a valid Acceleration Range')
 
@@ -207,21 +509,81 @@ class mpu6050:
         # Write the new range to the ACCEL_CONFIG register
         self.bus.write_byte_data(self.address, self.GYRO_CONFIG, mpu6050.GYRO_RANGE_MAP.get(gyro_range))
 
-        # Set the current gyro range
+        # Set the current gyro range and the counts -> deg/s factor
         self.gyro_range=gyro_range
+        self._gyro_mul=1.0/mpu6050.GYRO_SCALE_MAP[gyro_range]
 
-    def get_gyro_data(self):
+    def get_gyro_data(self, raw=None):
         """Gets and returns the X, Y and Z values from the gyroscope.
 
-        Returns the read values in a dictionary.
+        raw -- optional (x, y, z) raw counts, e.g. read_sensor_block()[4:7].
+        If omitted the registers are read from the sensor.
+        Returns the read values in deg/s as a GyroXYZ named tuple.
         """
-        l.info(f'{__class__.__name__}.get_gyro_data()')
-        xyz=[self.read_i2c_word(reg) for reg in [mpu6050.GYRO_XOUTH,mpu6050.GYRO_YOUTH,mpu6050.GYRO_ZOUTH]]
+        l.info('%s.get_gyro_data()', __class__.__name__)
+
+        if raw is None:
+            raw=self.read_sensor_block()[4:7]
+        xyz=raw
 
         try:
-            xyz=[i/mpu6050.GYRO_SCALE_MAP.get(self.gyro_range) for i in xyz]
+            xyz=[v*self._gyro_mul for v in xyz]
         except TypeError:
-            l.error(f'{__class__.__name__}.get_gyro_data(), error')         
+            l.error('%s.get_gyro_data(), error', __class__.__name__)
             xyz=[None,None,None]
 
-        return {'x': xyz[0], 'y': xyz[1], 'z': xyz[2]}
+        return GyroXYZ(xyz[0], xyz[1], xyz[2])
+
+    def set_dlpf(self, cfg):
+        """Sets the digital low pass filter of the accelerometer and gyro.
+
+        cfg -- DLPF_CFG value from 0 (filter off) to 6 (~5 Hz bandwidth),
+        see page 13 of the register map. 3 gives about 44 Hz.
+        Switching the filter on or off changes the base rate the sample rate
+        divider applies to, so the last requested sample rate is re-applied.
+        """
+        l.info('%s.set_dlpf() - Setting DLPF_CFG to %s', __class__.__name__, cfg)
+        if not 0 <= cfg <= 6:
+            raise ValueError(f'{cfg} is not a valid DLPF configuration')
+
+        # Check the requested rate is reachable before touching the sensor
+        rate = self._requested_rate
+        if rate is not None:
+            self._sample_rate_divider(rate, cfg)
+
+        self.bus.write_byte_data(self.address, self.CONFIG, cfg & 0x07)
+
+        # Store the current filter setting
+        self.dlpf=cfg
+
+        if rate is not None:
+            self.set_sample_rate(rate)
+
+    def _sample_rate_divider(self, hz, dlpf):
+        """Returns (divider, base rate) for hz with DLPF_CFG dlpf.
+
+        Raises ValueError if hz can't be reached.
+        """
+        if hz <= 0:
+            raise ValueError(f'{hz} Hz is not a valid sample rate')
+        base = 8000 if dlpf == 0 else 1000
+        div = round(base/hz) - 1
+        if not 0 <= div <= 255:
+            raise ValueError(f'{hz} Hz is not a valid sample rate with DLPF_CFG={dlpf}')
+        return div, base
+
+    def set_sample_rate(self, hz):
+        """Sets the sample rate of the sensor registers.
+
+        hz -- the requested rate. The gyro output rate is 1 kHz with the
+        DLPF enabled and 8 kHz without it; the closest divider is used.
+        set_dlpf() re-applies the requested rate when it changes the base.
+        """
+        l.info('%s.set_sample_rate() - Setting sample rate to %s Hz', __class__.__name__, hz)
+        div, base = self._sample_rate_divider(hz, self.dlpf)
+
+        self.bus.write_byte_data(self.address, self.SMPLRT_DIV, div)
+
+        # Store the requested and the actual sample rate
+        self._requested_rate=hz
+        self.sample_rate=base/(1 + div)
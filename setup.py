@@ -1,4 +1,15 @@
-from setuptools import setup
+from setuptools import setup, Extension
+
+try:
+    from Cython.Build import cythonize
+    # -ffp-contract=off keeps GCC from fusing multiply-adds, so the results
+    # match the Python fallback in mpu6050/_kernels.py bit for bit
+    ext_modules = cythonize([Extension('mpu6050._core', ['mpu6050/_core.pyx'], libraries=['m'],
+                                       extra_compile_args=['-ffp-contract=off'])],
+                            language_level=3)
+except ImportError:
+    # Without Cython the pure Python kernels in mpu6050/_kernels.py are used
+    ext_modules = []
 
 def readme():
     with open('README.rst') as f:
@@ -21,5 +32,6 @@ setup(name='mpu6050-raspberrypi',
       license='MIT',
       packages=['mpu6050'],
       scripts=['bin/mpu6050-example'],
+      ext_modules=ext_modules,
       zip_safe=False,
       long_description=readme())
@@ -1,24 +1,45 @@
-from mpu6050 import mpu6050
-from time import sleep
+from mpu6050 import mpu6050, format_line
+import asyncio
+import atexit
+import os
 import sys
 import datetime as dt
-import json
 
 path=f'RawData/GryoTest_{dt.datetime.now().strftime("%m%d%y_%H%M")}.json'
-sensor=mpu6050(0x68)
 
-while True:
+# GPIO line wired to the MPU-6050 INT pin, None to poll on a timer
+INT_PIN=None
+
+sensor=mpu6050(0x68, int_pin=INT_PIN)
+sensor.set_sample_rate(10)
+
+# Number of samples collected before they are written to the file
+BATCH_SIZE=50
+
+fd=os.open(path, os.O_WRONLY|os.O_APPEND|os.O_CREAT, 0o644)
+atexit.register(os.close, fd)
+
+async def main():
+    lines=[]
     try:
-        xyz=sensor.get_accel_data()
-        angle=sensor.calculate_angle(xyz)
-        xyz.update({'theta':angle,'timestamp':dt.datetime.now().timestamp()})
-        with open(path,'a') as f:
-            f.write(json.dumps(xyz))
-            f.write('\n')
-        print(xyz)
-        sleep(0.1)
-    except KeyboardInterrupt:
-        print('Interrupted')
-        break
-
-sys.exit(0)
\ No newline at end of file
+        async for accel,gyro,temp,angle in sensor.stream(10):
+            if angle is None:
+                # Failed bus read, nothing to record
+                continue
+            # Fixed-schema record, formatted without json.dumps
+            line=format_line(accel.x, accel.y, accel.z, angle, dt.datetime.now().timestamp())
+            lines.append(line)
+            if len(lines)>=BATCH_SIZE:
+                os.write(fd, b''.join(lines))
+                lines.clear()
+            print(line.decode(), end='')
+    finally:
+        if lines:
+            os.write(fd, b''.join(lines))
+
+try:
+    asyncio.run(main())
+except KeyboardInterrupt:
+    print('Interrupted')
+
+sys.exit(0)
@@ -0,0 +1,65 @@
+"""Checks the decode/format kernels against known values and each other.
+
+The Cython extension, the numba build and the plain Python fallback in
+mpu6050/_kernels.py must agree byte for byte.
+"""
+import struct
+from array import array
+
+import pytest
+
+pytest.importorskip('smbus2')  # imported by the mpu6050 package
+from mpu6050 import _kernels
+
+try:
+    from mpu6050 import _core
+except ImportError:
+    _core = None
+
+needs_core = pytest.mark.skipif(_core is None, reason='mpu6050._core is not built')
+
+# A known ACCEL_XOUTH..GYRO_ZOUTL block, including both int16 extremes
+BLOCK = struct.pack('>7h', 1000, 8192, -3000, 340, 32767, -65, -32768)
+AM = 9.80665 / 8192.0
+GM = 1.0 / 65.5
+
+# Decoded accel x/y/z and tilt angle of BLOCK, plus a timestamp
+RECORD = (1.197100830078125, 9.80665, -3.5913024902343746, 21.10759667991789, 1700000000.123456)
+LINE = b'{"x":1.197101,"y":9.806650,"z":-3.591302,"theta":21.107597,"timestamp":1700000000.123456}\n'
+
+
+def _implementations(func):
+    """The fallback itself and, for a numba dispatcher, its Python source."""
+    return [func] + ([func.py_func] if hasattr(func, 'py_func') else [])
+
+
+def _decode(func, buf):
+    out = array('d', [0.0] * 7)
+    angle = func(buf, AM, GM, out)
+    return out.tobytes(), struct.pack('d', angle)
+
+
+@pytest.mark.parametrize('func', _implementations(_kernels.fallback_decode))
+def test_decode_values(func):
+    out = array('d', [0.0] * 7)
+    angle = func(BLOCK, AM, GM, out)
+    assert list(out) == [RECORD[0], RECORD[1], RECORD[2], 37.53,
+                         32767 * GM, -65 * GM, -32768 * GM]
+    assert angle == RECORD[3]
+
+
+def test_format_line_value():
+    assert _kernels.fallback_format_line(*RECORD) == LINE
+
+
+@needs_core
+@pytest.mark.parametrize('func', _implementations(_kernels.fallback_decode))
+@pytest.mark.parametrize('buf', [BLOCK, bytearray(BLOCK)])
+def test_decode_matches_core(func, buf):
+    assert _decode(func, buf) == _decode(_core.decode, buf)
+
+
+@needs_core
+@pytest.mark.parametrize('record', [RECORD, (0.0, -0.0, -1e-7, 180.0, 0.0)])
+def test_format_line_matches_core(record):
+    assert _kernels.fallback_format_line(*record) == _core.format_line(*record)
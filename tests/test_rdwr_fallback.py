@@ -0,0 +1,117 @@
+"""Checks when reads fall back from I2C_RDWR to SMBus block reads.
+
+Only errnos meaning "not supported" may switch paths; a failed transfer
+must be reported instead of retried.
+"""
+import ctypes
+import errno
+import importlib
+import struct
+import types
+
+import pytest
+
+pytest.importorskip('smbus2')
+mpu6050_module = importlib.import_module('mpu6050.mpu6050')
+
+BLOCK = struct.pack('>7h', 1000, 8192, -3000, 340, 131, -65, 0)
+COUNTS = struct.unpack('>7h', BLOCK)
+
+
+class FakeSMBus:
+    """Just enough of smbus2.SMBus, backed by BLOCK at ACCEL_XOUTH."""
+    fd = 3
+
+    def __init__(self, bus):
+        self.calls = []
+        self.rdwr_error = None
+
+    def write_byte_data(self, address, register, value):
+        pass
+
+    def read_byte_data(self, address, register):
+        return 0
+
+    def i2c_rdwr(self, write, read):
+        self.calls.append('i2c_rdwr')
+        if self.rdwr_error is not None:
+            raise OSError(self.rdwr_error, errno.errorcode[self.rdwr_error])
+        register = list(write)[0] - 0x3B
+        ctypes.memmove(read.buf, BLOCK[register:register + read.len], read.len)
+
+    def read_i2c_block_data(self, address, register, length):
+        self.calls.append('read_i2c_block_data')
+        register -= 0x3B
+        return list(BLOCK[register:register + length])
+
+
+@pytest.fixture
+def sensor(monkeypatch):
+    monkeypatch.setattr(mpu6050_module.smbus2, 'SMBus', FakeSMBus)
+    return mpu6050_module.mpu6050(0x68)
+
+
+def test_read_block_uses_rdwr(sensor):
+    assert sensor.read_i2c_word(sensor.ACCEL_YOUTH) == COUNTS[1]
+    assert sensor.bus.calls == ['i2c_rdwr']
+
+
+@pytest.mark.parametrize('error', [errno.EOPNOTSUPP, errno.EINVAL])
+def test_read_block_falls_back_when_unsupported(sensor, error):
+    sensor.bus.rdwr_error = error
+    assert sensor.read_i2c_word(sensor.ACCEL_XOUTH) == COUNTS[0]
+    assert sensor.read_i2c_word(sensor.ACCEL_ZOUTH) == COUNTS[2]
+    # I2C_RDWR is only tried once, later reads go straight to SMBus
+    assert sensor.bus.calls == ['i2c_rdwr', 'read_i2c_block_data', 'read_i2c_block_data']
+    assert not sensor._use_rdwr
+
+
+def test_read_block_reports_bus_errors(sensor):
+    sensor.bus.rdwr_error = errno.EREMOTEIO
+    assert sensor.read_i2c_word(sensor.ACCEL_XOUTH) is None
+    assert sensor.bus.calls == ['i2c_rdwr']
+    assert sensor._use_rdwr
+
+
+def _patch_ioctl(monkeypatch, sensor, error=None):
+    """Replaces fcntl.ioctl for the prebuilt sample read; returns its call log."""
+    calls = []
+
+    def ioctl(fd, request, arg):
+        calls.append(request)
+        if error is not None:
+            raise OSError(error, errno.errorcode[error])
+        ctypes.memmove(arg.msgs[1].buf, BLOCK, len(BLOCK))
+
+    monkeypatch.setattr(mpu6050_module, 'fcntl', types.SimpleNamespace(ioctl=ioctl))
+    return calls
+
+
+def test_sample_block_uses_prebuilt_ioctl(monkeypatch, sensor):
+    calls = _patch_ioctl(monkeypatch, sensor)
+    assert sensor.read_sensor_block() == COUNTS
+    assert len(calls) == 1
+    assert sensor.bus.calls == []
+
+
+@pytest.mark.parametrize('error', [errno.EOPNOTSUPP, errno.EINVAL])
+def test_sample_block_falls_back_when_unsupported(monkeypatch, sensor, error):
+    calls = _patch_ioctl(monkeypatch, sensor, error)
+    assert sensor.read_sensor_block() == COUNTS
+    assert sensor.read_sensor_block() == COUNTS
+    # The prebuilt ioctl is tried once; rejecting it drops I2C_RDWR as a whole
+    assert len(calls) == 1
+    assert sensor.bus.calls == ['read_i2c_block_data', 'read_i2c_block_data']
+    assert sensor._rdwr_arg is None
+    assert not sensor._use_rdwr
+
+
+def test_sample_block_reports_bus_errors(monkeypatch, sensor):
+    calls = _patch_ioctl(monkeypatch, sensor, errno.EREMOTEIO)
+    assert sensor.read_sensor_block() == (None,) * 7
+    accel, gyro, temp, angle = sensor.read_sample()
+    assert accel == (None, None, None) and gyro == (None, None, None)
+    assert temp is None and angle is None
+    assert len(calls) == 2
+    assert sensor.bus.calls == []
+    assert sensor._rdwr_arg is not None